@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from tmfc_simulation.wilson_cowan_task_simulation import HRF
+
+
+def test_task_design_activation_one_row_per_region():
+    hrf = HRF(3, dt=10)
+    activation = hrf.create_task_design_activation([[1, 4], [2], [3, 4]], duration=1)
+    assert activation.shape[0] == 3
+    shared = hrf.create_task_design_activation([1, 4], duration=1)
+    assert shared.shape == activation.shape
+    assert np.array_equal(shared[0], shared[2])
+
+
+def test_task_design_activation_rejects_missing_onsets():
+    hrf = HRF(3, dt=10)
+    with pytest.raises(AssertionError):
+        hrf.create_task_design_activation([[1, 4], [2]], duration=1)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from tmfc_simulation.wilson_cowan_task_simulation import WCTaskSim
+
+
+def _make_sim(use_numba, seed=3):
+    rng = np.random.RandomState(0)
+    W = rng.uniform(0, 0.1, (4, 4))
+    np.fill_diagonal(W, 0)
+    sim = WCTaskSim({"Task_A": W}, W, np.full((4, 4), 10.),
+                    onset_time_list=[2.], task_name_list=["Task_A"], duration_list=1.,
+                    sigma_ou=0.1, use_numba=use_numba, seed=seed)
+    sim.wc.params['exc_init'] = np.full((4, 1), 0.05)
+    sim.wc.params['inh_init'] = np.full((4, 1), 0.05)
+    return sim
+
+
+def _run_block_from_same_state(sim):
+    # same initial state for each block, so only noise can make blocks differ
+    sim.wc.params['exc_init'] = np.full((4, 1), 0.05)
+    sim.wc.params['inh_init'] = np.full((4, 1), 0.05)
+    sim.wc.params['exc_ou'] = np.zeros(4)
+    sim.wc.params['inh_ou'] = np.zeros(4)
+    sim._generate_single_block(sim.Wij_rest, duration=1, activity=False)
+    return np.array(sim.wc.exc, copy=True)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_blocks_get_different_noise(use_numba):
+    sim = _make_sim(use_numba)
+    first = _run_block_from_same_state(sim)
+    second = _run_block_from_same_state(sim)
+    assert first.shape == second.shape
+    assert not np.allclose(first, second)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_same_seed_reproduces_blocks(use_numba):
+    runs = []
+    for _ in range(2):
+        sim = _make_sim(use_numba)
+        runs.append([_run_block_from_same_state(sim) for _ in range(2)])
+    np.testing.assert_array_equal(runs[0][0], runs[1][0])
+    np.testing.assert_array_equal(runs[0][1], runs[1][1])
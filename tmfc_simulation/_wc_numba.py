@@ -0,0 +1,176 @@
+import numpy as np
+import numba
+from collections import namedtuple
+
+# scalar parameters of the Wilson-Cowan node, passed to the kernel as a
+# namedtuple so numba can specialise on plain floats
+WCParams = namedtuple("WCParams", ["dt", "K_gl",
+                                   "tau_exc", "tau_inh",
+                                   "a_exc", "a_inh",
+                                   "mu_exc", "mu_inh",
+                                   "c_excexc", "c_excinh",
+                                   "c_inhexc", "c_inhinh",
+                                   "exc_ext", "inh_ext",
+                                   "tau_ou", "sigma_ou",
+                                   "exc_ou_mean", "inh_ou_mean"])
+
+
+def pack_params(params) -> WCParams:
+    """Collect scalar parameters of neurolib WCModel params into WCParams
+
+    Args:
+        params (dict): parameters of neurolib WCModel (wc.params)
+
+    Returns:
+        WCParams namedtuple with float values
+    """
+    return WCParams(*[float(params[name]) for name in WCParams._fields])
+
+
+# number of integration steps with noise drawn at once, also the number of
+# steps between moves of the history to the front of the working buffer
+NOISE_CHUNK = 1024
+
+
+@numba.njit(cache=True, fastmath=True)
+def wc_step(exc_hist, inh_hist, cmats, dmat, indptr, indices, data, delays,
+            seg_mats, seg_ends, exc_ou, inh_ou, params, rng, n_steps,
+            out_exc, out_inh, start=0, stride=1):
+    """Euler-Maruyama integration of the Wilson-Cowan network with
+    the same equations as neurolib timeIntegration for wc model.
+    Consecutive segments of integration (blocks) can have own coupling matrices,
+    given either dense (cmats, dmat) or, for sparse matrices, in CSR format
+    (indptr, indices, data, delays), so only existing connections are looped.
+    States are kept time-major in a buffer of max_delay + 1 + NOISE_CHUNK steps,
+    so delayed states are read without wrapping indexes, the trajectory
+    is written to out_exc, out_inh every stride step starting from start.
+
+    Args:
+        exc_hist (np.ndarray): excitatory history, shape (max_delay + 1, N),
+            chronological (last row is the current state), replaced in-place
+            by the history at the end of integration
+        inh_hist (np.ndarray): inhibitory history, shape (max_delay + 1, N)
+        cmats (np.ndarray): dense coupling matrices (num_matrices, N, N),
+            empty (0, N, N) if CSR format is used
+        dmat (np.ndarray): delays in integration steps (N, N) for dense matrices
+        indptr (np.ndarray): CSR row pointers of each coupling matrix (num_matrices, N + 1)
+        indices (np.ndarray): CSR column indices of coupling matrices
+        data (np.ndarray): CSR values of coupling matrices
+        delays (np.ndarray): delays in integration steps for each CSR value
+        seg_mats (np.ndarray): coupling matrix index of each segment (num_segments,)
+        seg_ends (np.ndarray): integration step where each segment ends (num_segments,)
+        exc_ou (np.ndarray): excitatory Ornstein-Uhlenbeck state (N,), updated in-place
+        inh_ou (np.ndarray): inhibitory Ornstein-Uhlenbeck state (N,), updated in-place
+        params (WCParams): scalar parameters of the model
+        rng (np.random.Generator): generator of noise, its state is advanced
+        n_steps (int): number of integration steps
+        out_exc (np.ndarray): output for excitatory activity (N, len(range(start, n_steps, stride)))
+        out_inh (np.ndarray): output for inhibitory activity, same shape
+        start (int): first integration step written to output
+        stride (int): step between written integration steps
+    """
+    hist_len, N = exc_hist.shape
+    dense = cmats.shape[0] > 0
+    dt = params.dt
+    sqrt_dt = np.sqrt(dt)
+    exc_buf = np.empty((hist_len + NOISE_CHUNK, N))
+    inh_buf = np.empty((hist_len + NOISE_CHUNK, N))
+    exc_buf[:hist_len] = exc_hist
+    inh_buf[:hist_len] = inh_hist
+    s = 0
+
+    for t0 in range(0, n_steps, NOISE_CHUNK):
+        m = min(NOISE_CHUNK, n_steps - t0)
+        noise = rng.standard_normal((m, 2, N))
+        for c in range(m):
+            t = t0 + c
+            # coupling is switched at the segment boundary
+            while t >= seg_ends[s]:
+                s += 1
+            k_mat = seg_mats[s]
+            row = hist_len + c
+            for i in range(N):
+                exc_prev = exc_buf[row - 1, i]
+                inh_prev = inh_buf[row - 1, i]
+
+                # delayed input from other nodes
+                exc_input_d = 0.0
+                if dense:
+                    for j in range(N):
+                        exc_input_d += cmats[k_mat, i, j] * exc_buf[row - dmat[i, j] - 1, j]
+                else:
+                    for p in range(indptr[k_mat, i], indptr[k_mat, i + 1]):
+                        exc_input_d += data[p] * exc_buf[row - delays[p] - 1, indices[p]]
+                exc_input_d *= params.K_gl
+
+                exc_rhs = 1 / params.tau_exc * (
+                        -exc_prev + (1 - exc_prev) / (1.0 + np.exp(-params.a_exc * (
+                            params.c_excexc * exc_prev - params.c_inhexc * inh_prev
+                            + exc_input_d + params.exc_ext - params.mu_exc)))
+                        + exc_ou[i])
+                inh_rhs = 1 / params.tau_inh * (
+                        -inh_prev + (1 - inh_prev) / (1.0 + np.exp(-params.a_inh * (
+                            params.c_excinh * exc_prev - params.c_inhinh * inh_prev
+                            + params.inh_ext - params.mu_inh)))
+                        + inh_ou[i])
+
+                exc_buf[row, i] = exc_prev + dt * exc_rhs
+                inh_buf[row, i] = inh_prev + dt * inh_rhs
+
+                # Ornstein-Uhlenbeck process
+                exc_ou[i] = (exc_ou[i] + (params.exc_ou_mean - exc_ou[i]) * dt / params.tau_ou
+                             + params.sigma_ou * sqrt_dt * noise[c, 0, i])
+                inh_ou[i] = (inh_ou[i] + (params.inh_ou_mean - inh_ou[i]) * dt / params.tau_ou
+                             + params.sigma_ou * sqrt_dt * noise[c, 1, i])
+
+            if t >= start and (t - start) % stride == 0:
+                k = (t - start) // stride
+                for i in range(N):
+                    out_exc[i, k] = exc_buf[row, i]
+                    out_inh[i, k] = inh_buf[row, i]
+
+        # last hist_len states are moved to the front of the buffer
+        for r in range(hist_len):
+            exc_buf[r] = exc_buf[m + r]
+            inh_buf[r] = inh_buf[m + r]
+
+    exc_hist[:] = exc_buf[:hist_len]
+    inh_hist[:] = inh_buf[:hist_len]
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def pair_phase_diff(angles, idx1, idx2, out):
+    """ Phase difference for each pair of regions, out[r] = angles[idx1[r]] - angles[idx2[r]]
+
+    Args:
+        angles (np.ndarray): phase angles, shape (N, T)
+        idx1 (np.ndarray): first region of each pair (P,)
+        idx2 (np.ndarray): second region of each pair (P,)
+        out (np.ndarray): output array with shape (P, T)
+    """
+    for r in numba.prange(idx1.shape[0]):
+        a = idx1[r]
+        b = idx2[r]
+        for t in range(angles.shape[1]):
+            out[r, t] = angles[a, t] - angles[b, t]
+
+
+@numba.njit(cache=True)
+def fill_task_labels(intervals, task_code, trial_number, trial_time_point):
+    """ Label time points of each task interval, later intervals overwrite earlier
+
+    Args:
+        intervals (np.ndarray): rows of (start index, end index, task code, trial number)
+        task_code (np.ndarray): task code for each time point, filled in-place
+        trial_number (np.ndarray): trial number for each time point, filled in-place
+        trial_time_point (np.ndarray): index inside the trial for each time point,
+            filled in-place
+    """
+    n = task_code.shape[0]
+    for k in range(intervals.shape[0]):
+        start = intervals[k, 0]
+        end = min(intervals[k, 1], n)
+        for t in range(start, end):
+            task_code[t] = intervals[k, 2]
+            trial_number[t] = intervals[k, 3]
+            trial_time_point[t] = t - start
@@ -19,7 +19,8 @@ def simulateBOLD(Z,
                  k2=None,
                  k3_mul=None,
                  fix:bool = True,
-                 voxelCounts=None):
+                 voxelCounts=None,
+                 scale: float = 1.0):
     """ Adopted function from neurolib, added parameters for the shape of bold activation to the argument,
     the only difference
     https://github.com/neurolib-dev/neurolib/blob/master/neurolib/models/bold/timeIntegration.py
@@ -42,6 +43,8 @@ def simulateBOLD(Z,
     :type Q: numpy.ndarray, optional
     :param V: Initial values of Blood volume, defaults to None
     :type V: numpy.ndarray, optional
+    :param scale: Factor applied to synaptic activity while it is read, defaults to 1
+    :type scale: float, optional
 
     :return: BOLD, X, F, Q, V
     :rtype: (numpy.ndarray,)
@@ -203,12 +206,12 @@ def simulateBOLD(Z,
     BOLD = np.zeros(np.shape(Z))
     # return integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N, rho, alpha, V0, k1, k2, k3, Gamma, K, Tau)
     BOLD, X, F, Q, V = integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N,
-                                           Rho, Alpha, V0, K1, k2, K3, Gamma, K, Tau)
+                                           Rho, Alpha, V0, K1, k2, K3, Gamma, K, Tau, scale)
     return BOLD, X, F, Q, V
 
 
-@numba.njit
-def integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N, Rho, Alpha, V0, K1, k2, K3, Gamma, K, Tau):
+@numba.njit(parallel=True, cache=True)
+def integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N, Rho, Alpha, V0, K1, k2, K3, Gamma, K, Tau, scale=1.0):
     """Integrate the Balloon-Windkessel model.
 
     Reference:
@@ -224,6 +227,8 @@ def integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N, Rho, Alpha, V0, K1, k2, K3,
     NOTE: A very small constant EPS is added to F to avoid F become too small / negative
     and cause a floating point error in EQ. Q due to the exponent **(1 / F[j])
 
+    Input Z is multiplied by scale at reading, so scaled copy of it is not needed
+
     """
 
     EPS = 1e-120  # epsilon for softening
@@ -232,15 +237,18 @@ def integrateBOLD_numba(BOLD, X, Q, F, V, Z, dt, N, Rho, Alpha, V0, K1, k2, K3,
     #V[0] = 1
     #Q[0] = 1
 
-    for i in range(len(Z[0, :])):  # loop over all timesteps
-        # component-wise loop for compatibilty with numba
-        for j in range(N):  # loop over all areas
-            X[j] = X[j] + dt * (Z[j, i] - K[j] * X[j] - Gamma[j] * (F[j] - 1))
-            Q[j] = Q[j] + dt / Tau[j] * (F[j] / Rho[j] * (1 - (1 - Rho[j]) ** (1 / F[j])) - Q[j] * V[j] ** (1 / Alpha[j] - 1))
-            V[j] = V[j] + dt / Tau[j] * (F[j] - V[j] ** (1 / Alpha[j]))
-            F[j] = F[j] + dt * X[j]
+    # areas are independent, so each area is integrated over all timesteps
+    # in parallel, the state of the area is kept in local variables
+    for j in numba.prange(N):  # loop over all areas
+        x, q, v, f = X[j], Q[j], V[j], F[j]
+        for i in range(Z.shape[1]):  # loop over all timesteps
+            x = x + dt * (scale * Z[j, i] - K[j] * x - Gamma[j] * (f - 1))
+            q = q + dt / Tau[j] * (f / Rho[j] * (1 - (1 - Rho[j]) ** (1 / f)) - q * v ** (1 / Alpha[j] - 1))
+            v = v + dt / Tau[j] * (f - v ** (1 / Alpha[j]))
+            f = f + dt * x
 
-            F[j] = max(F[j], EPS)
+            f = max(f, EPS)
 
-            BOLD[j, i] = V0 * (K1[j] * (1 - Q[j]) + k2 * (1 - Q[j] / V[j]) + K3[j] * (1 - V[j]))
+            BOLD[j, i] = V0 * (K1[j] * (1 - q) + k2 * (1 - q / v) + K3[j] * (1 - v))
+        X[j], Q[j], V[j], F[j] = x, q, v, f
     return BOLD, X, F, Q, V
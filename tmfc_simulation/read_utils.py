@@ -4,7 +4,8 @@ from .synaptic_weights_matrices import generate_synaptic_weights_matrices
 from typing import Optional
 
 
-def read_onsets_from_mat(mat_path: str) -> tuple[list, list, list]:
+def read_onsets_from_mat(mat_path: str,
+                         input_data: Optional[dict] = None) -> tuple[list, list, list]:
     """Extract onset moment from matlab files with the matlab file with all
      the information about task. Matfile represented with a structure with the
      next field:
@@ -22,10 +23,12 @@ def read_onsets_from_mat(mat_path: str) -> tuple[list, list, list]:
 
 
     :param mat_path:
+    :param input_data: already loaded content of mat_path, if None file is loaded
     :return: 3 lists with onsets, task_names and duration
     """
 
-    input_data = io.loadmat(mat_path)
+    if input_data is None:
+        input_data = io.loadmat(mat_path)
     assert "onsets" in input_data.keys(), 'onset key should be in structure'
     assert "names" in input_data.keys(), 'names key should be in structure'
     assert "durations" in input_data.keys(), 'durations key should be in structure'
@@ -52,7 +55,8 @@ def generate_sw_matrices_from_mat(mat_path: str,
                                   num_regions_per_modules: Optional[list] = None,
                                   sigma: float = 0.01,
                                   norm_type: str = "cols",
-                                  gen_type: str = 'simple_prod'):
+                                  gen_type: str = 'simple_prod',
+                                  input_data: Optional[dict] = None):
     """
     Generate task and rest matrices from mat file
     Matfile represented with a structure with the
@@ -80,11 +84,14 @@ def generate_sw_matrices_from_mat(mat_path: str,
             generation is equal to scaling normal distribution
             with factors, else - scaling with equal variance,
             possible values [simple_prod, equal_var]
+        input_data (dict):
+            already loaded content of mat_path, if None file is loaded
 
     return: rest matrix and list of task matrices
     """
     # TODO add num regions per module
-    input_data = io.loadmat(mat_path)
+    if input_data is None:
+        input_data = io.loadmat(mat_path)
     coeff_rest_matrix = input_data["rest_matrix"]
     coeff_task_matrices = input_data["task_matrices"]
     num_tasks = coeff_task_matrices.shape[1]
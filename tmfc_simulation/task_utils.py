@@ -3,8 +3,47 @@ from typing import Optional, Union
 import numpy.typing as npt
 
 
-def create_task_design_activation(onsets_list: list[list],
-                                  durations_list: Union[list[float], list[list]],
+def _pad_to_2d(rows: list, fill: float) -> npt.NDArray:
+    """ Stack rows of different length into 2D float array padded with fill """
+    out = np.full((len(rows), max(len(row) for row in rows)), fill, dtype=float)
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+
+def _boxcar_vectorized(onsets: npt.NDArray,
+                       durations: npt.NDArray,
+                       dt: float,
+                       length: int,
+                       offset: int = 0) -> npt.NDArray:
+    """ Box-car for each row of padded onsets (negative onset is padding),
+    events are marked as +1/-1 steps and integrated with cumsum
+
+    Args:
+        onsets (npt.NDArray): onsets in seconds, shape (num_tasks, max_events)
+        durations (npt.NDArray): durations in seconds, same shape as onsets
+        dt (float): sampling time in ms
+        length (int): number of time points of the design (without offset)
+        offset (int): number of zero points before the design
+
+    Returns:
+        box-car array with shape (num_tasks, offset + length)
+    """
+    rows, cols = np.nonzero(onsets >= 0)
+    onset = onsets[rows, cols]
+    start = np.minimum(np.rint((1000 / dt) * onset).astype(int), length)
+    end = np.minimum(np.rint((1000 / dt) * (onset + durations[rows, cols])).astype(int), length)
+    keep = start < end
+    rows, start, end = rows[keep], start[keep] + offset, end[keep] + offset
+    edges = np.zeros((onsets.shape[0], offset + length + 1))
+    np.add.at(edges, (rows, start), 1)
+    np.add.at(edges, (rows, end), -1)
+    # overlapping events of the same task are not summed up
+    return (np.cumsum(edges[:, :-1], axis=1) > 0).astype(float)
+
+
+def create_task_design_activation(onsets_list: Union[list[list], npt.NDArray],
+                                  durations_list: Union[list[float], list[list], npt.NDArray],
                                   dt: float = 0.1,
                                   first_rest: float = 5,
                                   last_rest: float = 5) -> npt.NDArray:
@@ -12,10 +51,12 @@ def create_task_design_activation(onsets_list: list[list],
     Create external activation array separately for each task, return box car with the same size as task
 
     Args:
-        onsets_list (list of list of float or list): onset list for each task,
-                    for example [10, 12, 15], N lists equal to number of tasks, onsets in seconds
-        durations_list (list of float or list of lists): duration of each task,
-        one number for each task or list of durations corresponds to each onset
+        onsets_list (list of list of float or list or np.ndarray): onset list for each task,
+                    for example [10, 12, 15], N lists equal to number of tasks, onsets in seconds,
+                    or 2D array (num_tasks, max_events) padded with -1
+        durations_list (list of float or list of lists or np.ndarray): duration of each task,
+        one number for each task or list of durations corresponds to each onset,
+        or 2D array with the same shape as padded onsets
         dt (float): sampling time in ms, i.e. 0.1 means 0.1ms
         last_rest (float): duration of the last rest part
         first_rest (float): duration of the first part
@@ -24,35 +65,33 @@ def create_task_design_activation(onsets_list: list[list],
     Returns:
         box-car function corresponded to design
     """
-    n_tasks = len(onsets_list)
-    if (n_tasks == 1) & ~isinstance(onsets_list[0], list):
-        onsets_list = [onsets_list]
-    assert all([isinstance(onsets, list) for onsets in onsets_list]), \
-        'For each task should be onset list'
-    assert len(durations_list) == len(onsets_list), \
-        "Duration should be specified for each task"
-    # find max onset and task corresponded
-    max_onsets = [np.max(onsets) for onsets in onsets_list]
-    task_max_onset, max_onset = np.argmax(max_onsets), np.max(max_onsets)
-
-    for i, durations in enumerate(durations_list):
-        if isinstance(durations, (list, tuple)):
-            assert len(durations) == len(onsets_list[i]), \
-                "if list of duration provided, length should corresponds to onsets list"
-        else:
-            durations_list[i] = [durations] * len(onsets_list[i])
-    max_onset = np.max([np.max(onsets) for onsets in onsets_list])
-    max_duration = durations_list[task_max_onset][-1]
+    if isinstance(onsets_list, np.ndarray) and onsets_list.ndim == 2:
+        onsets = onsets_list.astype(float)
+        durations = np.broadcast_to(np.asarray(durations_list, dtype=float), onsets.shape)
+    else:
+        n_tasks = len(onsets_list)
+        if (n_tasks == 1) & ~isinstance(onsets_list[0], list):
+            onsets_list = [onsets_list]
+        assert all([isinstance(onsets, list) for onsets in onsets_list]), \
+            'For each task should be onset list'
+        assert len(durations_list) == len(onsets_list), \
+            "Duration should be specified for each task"
+        for i, durations in enumerate(durations_list):
+            if isinstance(durations, (list, tuple)):
+                assert len(durations) == len(onsets_list[i]), \
+                    "if list of duration provided, length should corresponds to onsets list"
+        onsets = _pad_to_2d(onsets_list, fill=-1)
+        durations = _pad_to_2d([np.broadcast_to(np.asarray(durations, dtype=float),
+                                                (len(onsets_list[i]),))
+                                for i, durations in enumerate(durations_list)], fill=0)
+    # find max onset and last duration of the task corresponded
+    masked_onsets = np.where(onsets >= 0, onsets, -np.inf)
+    task_max_onset = np.argmax(masked_onsets.max(axis=1))
+    max_onset = masked_onsets[task_max_onset].max()
+    max_duration = durations[task_max_onset, np.sum(onsets[task_max_onset] >= 0) - 1]
     length = int((max_onset + max_duration + last_rest) * 1000 / dt)
     length_first_rest = int(first_rest * 1000 / dt)
-    activation = np.zeros((n_tasks, length))
-
-    for i, onsets in enumerate(onsets_list):
-        for onset, duration in zip(onsets, durations_list[i]):
-            start = int(round((1000 / dt) * onset))
-            end = int(round((1000 / dt) * (onset + duration)))
-            activation[i, start:end] = 1
-    return np.hstack((np.zeros((n_tasks, length_first_rest)), activation))
+    return _boxcar_vectorized(onsets, durations, dt, length, offset=length_first_rest)
 
 
 def module_activation(tasks_responded: Union[int, list[int]],
@@ -1,4 +1,5 @@
-from scipy import signal, stats, io
+from scipy import signal, stats, io, sparse
+from scipy import fft as sp_fft
 import xarray as xr
 import matplotlib.pyplot as plt
 from neurolib.models.wc import WCModel
@@ -6,12 +7,15 @@ from neurolib.utils.collections import dotdict
 from .boldIntegration import simulateBOLD
 from .read_utils import generate_sw_matrices_from_mat
 from .read_utils import read_onsets_from_mat
+from ._wc_numba import (wc_step, pack_params,
+                        pair_phase_diff, fill_task_labels)
 import numpy as np
+from functools import lru_cache
 from typing import Optional, Union
 import numpy.typing as npt
 from .task_utils import (create_task_design_activation,
                          create_reg_activations,
-                        create_activations_per_module)
+                         _pad_to_2d, _boxcar_vectorized)
 
 
 class WCTaskSim:
@@ -37,6 +41,9 @@ class WCTaskSim:
                  exc_ext: float = 0.75,
                  K_gl: float = 2.85,
                  sigma_ou: float = 5 * 1e-3,
+                 use_numba: bool = False,
+                 sparse_threshold: float = 0.3,
+                 seed: Optional[int] = None,
                  **kwargs):
         """ The most arguments chosen in accordance to neurolib inputs. The key difference
         is changing weight matrix during simulation
@@ -82,6 +89,14 @@ class WCTaskSim:
                 coupling parameter
             sigma_ou (float):
                 sigma parameter
+            use_numba (bool):
+                True if integrate blocks with own numba kernel (see _wc_numba)
+                instead of wc.run, not used with neurolib bold or chunkwise
+            sparse_threshold (float):
+                if fraction of nonzero weights in rest matrix is lower, coupling
+                for synaptic activity is computed with sparse matrices
+            seed (int):
+                seed of wc model for initial values and noise, None means random
             **kwargs:
                 other parameters for wc model
         """
@@ -94,7 +109,7 @@ class WCTaskSim:
         self.output_activation = None
         self.rest_before = rest_before
         self.Wij_rest = Wij_rest
-        self.wc = WCModel(Cmat=self.Wij_rest, Dmat=self.Dmat)
+        self.wc = WCModel(Cmat=self.Wij_rest, Dmat=self.Dmat, seed=seed)
         self.Wij_task_dict = Wij_task_dict
         self.num_tasks = len(Wij_task_dict.keys())
         if task_name_list is None:
@@ -103,6 +118,20 @@ class WCTaskSim:
         assert sum([task_name in Wij_task_dict.keys()
                     for task_name in task_name_list]) == len(
             task_name_list), "Name in task names not from the dict"
+        # integer task codes of the design, index matrices in _cmats
+        self._task_names = list(self.Wij_task_dict)
+        self._cmats = [self.Wij_task_dict[name] for name in self._task_names]
+        self._task_codes = np.array([self._task_names.index(name)
+                                     for name in self.task_name_list], dtype=np.int32)
+        # no self connections, matrices are only assigned to the model later
+        np.fill_diagonal(self.Wij_rest, 0)
+        for task_name in self.Wij_task_dict:
+            np.fill_diagonal(self.Wij_task_dict[task_name], 0)
+        # sparse copies of matrices by id, model itself is integrated with dense ones
+        self._sparse_cmats = {}
+        if np.mean(self.Wij_rest != 0) < sparse_threshold:
+            for Cmat in [self.Wij_rest, *self.Wij_task_dict.values()]:
+                self._sparse_cmats[id(Cmat)] = sparse.csr_matrix(Cmat)
         if onset_time_list is None:
             self.onset_time_list = list(np.arange(len(self.task_name_list)))
         else:
@@ -111,7 +140,7 @@ class WCTaskSim:
             self.onset_time_list), (
             "Number of tasks should be equal to number of onset times")
         if len(self.onset_time_list) > 1:
-            assert (np.diff(self.onset_time_list) > 0).any(), (
+            assert (np.diff(self.onset_time_list) > 0).all(), (
                 "Next onset time should be more than previous ")
 
         if isinstance(duration_list, (list, tuple)):
@@ -128,7 +157,33 @@ class WCTaskSim:
         self.exc_rest = None
         # activity sampling rate in ms
         self.activity = {"exc_series": None, "inh_series": None, "sa_series": None,
-                         "sampling_rate": act_sampling_rate, "idx_last_t": 0, "t": None}
+                         "sampling_rate": act_sampling_rate, "idx_last_t": 0,
+                         "t": None}
+        # dtype of stored downsampled exc and inh activity, integration itself is in float64
+        self.activity_dtype = np.float32
+        # synaptic activity has large mean, its fast oscillations used for phases
+        # are below float32 resolution at that level, so it stays in float64
+        self.sa_dtype = np.float64
+        # preallocated buffers for downsampled activity, filled up to _cursor,
+        # activity series are views to them
+        self._exc_buf = None
+        self._inh_buf = None
+        self._sa_buf = None
+        self._t_buf = None
+        self._cursor = 0
+        # bold input not yet convolved (less than TR) at the start of the buffer
+        self._carry = None
+        self._carry_len = 0
+        # raw activity of the last block waiting for bold generation
+        self._pending_chunk = {"exc": None, "inh": None}
+        self._clear_raw = False
+        self._raw_required = True
+        # noise is seeded once per simulation from the model seed: numba blocks
+        # continue one generator, wc.run blocks get own seeds spawned from it
+        self._rng = None
+        self._seed_seq = None
+        # content of loaded mat files by path
+        self._mat_cache = {}
         self.bold = bold
         self.bold_input_ready = False
         self.TR = None
@@ -160,6 +215,7 @@ class WCTaskSim:
         self.exc_ext = exc_ext
         self.K_gl = K_gl
         self.sigma_ou = sigma_ou
+        self.use_numba = use_numba
         self.init_wc_model()
 
     def init_wc_model(self):
@@ -184,6 +240,30 @@ class WCTaskSim:
         self.wc.params['c_inhinh'] = self.kwargs['c_inhinh']
         self.wc.params['c_inhexc'] = self.kwargs['c_inhexc']
 
+        # (dt, signalV) for which values derived from them were computed
+        self._dt_key = None
+        self._refresh_dt()
+
+    def _refresh_dt(self):
+        """ Re-read integration step (in ms) and signal speed from model params,
+        they can be changed after construction with wc.params, so delays in steps,
+        sampling strides and coupling arrays are recomputed if they differ """
+        key = (self.wc.params['dt'], self.wc.params['signalV'])
+        if key == self._dt_key:
+            return
+        self._dt_key = key
+        self._dt = self.wc.params['dt']
+        # delays in integration steps for numba integration
+        if self.wc.params['signalV'] > 0:
+            self._Dmat_steps = np.rint(self.Dmat / self.wc.params['signalV']
+                                       / self._dt).astype(np.int32)
+        else:
+            self._Dmat_steps = np.zeros(self.Dmat.shape, dtype=np.int32)
+        # activity sampling rate (in sec) -> number of integration steps
+        self._cached_srdt = {}
+        # CSR coupling with aligned delays for each matrix used in numba integration
+        self._numba_coupling = {}
+
     @classmethod
     def from_matlab_structure(cls, mat_path: str,
                               sigma: float = 0.1,
@@ -235,36 +315,76 @@ class WCTaskSim:
         """
         cls.num_modules = num_modules
         cls.num_regions_per_modules = num_regions_per_modules
+        # mat file is read once, its content is kept for the later methods
+        input_data = io.loadmat(mat_path)
         Wij_rest, Wij_task_dict = generate_sw_matrices_from_mat(mat_path,
                                                                 num_regions,
                                                                 num_modules,
                                                                 num_regions_per_modules,
                                                                 sigma=sigma,
                                                                 gen_type=gen_type,
-                                                                norm_type=norm_type)
+                                                                norm_type=norm_type,
+                                                                input_data=input_data)
         D = np.ones((num_regions, num_regions)) * delay
 
-        onset_time_list, task_names_list, duration_list = read_onsets_from_mat(mat_path)
-
-        return cls(Wij_task_dict,
-                   Wij_rest,
-                   D,
-                   onset_time_list=onset_time_list,
-                   task_name_list=task_names_list,
-                   duration_list=duration_list,
-                   rest_before=rest_before,
-                   first_duration=first_duration,
-                   last_duration=last_duration,
-                   normalize_max=normalize_max,
-                   output_activation=output_activation,
-                   append_outputs=append_outputs,
-                   bold=bold,
-                   chunkwise=chunkwise,
-                   num_modules=num_modules,
-                   exc_ext=exc_ext,
-                   K_gl=K_gl,
-                   sigma_ou=sigma_ou,
-                   **kwargs)
+        onset_time_list, task_names_list, duration_list = read_onsets_from_mat(mat_path,
+                                                                               input_data=input_data)
+
+        sim = cls(Wij_task_dict,
+                     Wij_rest,
+                     D,
+                     onset_time_list=onset_time_list,
+                     task_name_list=task_names_list,
+                     duration_list=duration_list,
+                     rest_before=rest_before,
+                     first_duration=first_duration,
+                     last_duration=last_duration,
+                     normalize_max=normalize_max,
+                     output_activation=output_activation,
+                     append_outputs=append_outputs,
+                     bold=bold,
+                     chunkwise=chunkwise,
+                     num_modules=num_modules,
+                     exc_ext=exc_ext,
+                     K_gl=K_gl,
+                     sigma_ou=sigma_ou,
+                     **kwargs)
+        sim._mat_cache[mat_path] = input_data
+        return sim
+
+    @classmethod
+    def run_many(cls,
+                 mat_paths: list[str],
+                 n_jobs: int = -1,
+                 seed: Optional[int] = None,
+                 generate_kwargs: Optional[dict] = None,
+                 **kwargs) -> list[tuple]:
+        """Run independent simulations (one per matfile, e.g. subjects) in parallel
+        processes with joblib, each simulation is created with from_matlab_structure
+        and generated with generate_full_series
+
+        Args:
+            mat_paths (list of str): paths to matfiles, path can be repeated
+            n_jobs (int): number of processes, -1 means all cores
+            seed (int): if set, seed of each simulation (weight matrices and
+                wc model) is derived from it, so results are reproducible
+                under parallel execution
+            generate_kwargs (dict): parameters for generate_full_series
+            **kwargs: parameters for from_matlab_structure
+
+        Returns:
+            list of tuples (BOLD, activity) in the order of mat_paths
+        """
+        from joblib import Parallel, delayed
+
+        generate_kwargs = {} if generate_kwargs is None else generate_kwargs
+        if seed is None:
+            seeds = [None] * len(mat_paths)
+        else:
+            seeds = np.random.SeedSequence(seed).generate_state(len(mat_paths)).tolist()
+        return Parallel(n_jobs=n_jobs, backend='loky')(
+            delayed(_run_single_simulation)(cls, mat_path, seed_, generate_kwargs, kwargs)
+            for mat_path, seed_ in zip(mat_paths, seeds))
 
     def _generate_single_block(self,
                                Cmat: npt.NDArray,
@@ -288,110 +408,343 @@ class WCTaskSim:
         Returns:
 
         """
+        self._refresh_dt()
         # buit-in nativ neurolib chunkwise integration
         if self.chunkwise:
             assert duration % 2 == 0, (
                 "For faster integration time duration is chunkwise"
                 " duration should be divisible by two ")
         self.wc.params['Cmat'] = Cmat
-        np.fill_diagonal(self.wc.params['Cmat'], 0)
         self.wc.params['duration'] = duration * 1000  # duration in ms
-        self.wc.run(append_outputs=self.append_outputs,
-                    bold=self.bold,
-                    continue_run=True,
-                    chunkwise=self.chunkwise)
-        # in-place generation of synaptic activity
-        if syn_act:
-            syn_act_series = self.generate_neuronal_oscill()
+        if activity:
+            sampling_rate_dt, start_idx = self._activity_grid(a_s_rate)
+            slc = slice(start_idx, None, sampling_rate_dt)
+        use_numba = self.use_numba and not (self.bold or self.chunkwise)
+        # without further need of raw activity only downsampled points are kept
+        downsampled = use_numba and activity and not self._raw_required
+        if downsampled:
+            new_exc_activity, new_inh_activity, num_raw = self._run_numba(
+                start_idx, sampling_rate_dt)
+        elif use_numba:
+            self._run_numba()
+        else:
+            # neurolib reseeds np.random with the model seed at every run,
+            # so the block runs with its own seed and the model seed is restored
+            model_seed = self.wc.params['seed']
+            self.wc.params['seed'] = self._block_seed()
+            try:
+                self.wc.run(append_outputs=self.append_outputs,
+                            bold=self.bold,
+                            continue_run=True,
+                            chunkwise=self.chunkwise)
+            finally:
+                self.wc.params['seed'] = model_seed
         # for saving downsampled neural activity
         if activity:
-            idx_last_t = self.activity["idx_last_t"]
-            self.activity["sampling_rate"] = a_s_rate
-            sampling_rate_dt = int(round(1000 * a_s_rate / self.wc.params["dt"]))
-            new_exc_activity = self.wc.exc[:,
-                               sampling_rate_dt -
-                               np.mod(idx_last_t - 1,
-                                      sampling_rate_dt)::sampling_rate_dt
-                               ]
-            new_inh_activity = self.wc.inh[:,
-                               sampling_rate_dt -
-                               np.mod(idx_last_t - 1,
-                                      sampling_rate_dt)::sampling_rate_dt
-                               ]
-            if syn_act:
-                new_sa_activity = syn_act_series[:,
-                                  sampling_rate_dt -
-                                  np.mod(idx_last_t - 1,
-                                         sampling_rate_dt)::sampling_rate_dt
-                                  ]
-            if self.activity["exc_series"] is None:
-                self.activity["exc_series"] = new_exc_activity
-                self.activity["inh_series"] = new_inh_activity
-                if syn_act:
-                    self.activity["sa_series"] = new_sa_activity
-            else:
-                # noinspection PyTypedDict
-                self.activity["exc_series"] = np.hstack([self.activity["exc_series"],
-                                                         new_exc_activity])
-                # noinspection PyTypedDict
-                self.activity["inh_series"] = np.hstack([self.activity["inh_series"],
-                                                         new_inh_activity])
-                if syn_act:
-                    # noinspection PyTypedDict
-                    self.activity["sa_series"] = (
-                        np.hstack([self.activity["sa_series"],
-                                   new_sa_activity]))
-
-            new_idx_t = idx_last_t + np.arange(self.wc.exc.shape[1])
-            t_activity = self.wc.params["dt"] * (
-                new_idx_t[sampling_rate_dt -
-                          np.mod(idx_last_t - 1,
-                                 sampling_rate_dt)::sampling_rate_dt])
-            if self.activity["t"] is None:
-                self.activity["t"] = t_activity
-            else:
-                self.activity["t"] = np.hstack([self.activity["t"], t_activity])
-            self.activity["idx_last_t"] = idx_last_t + self.wc.exc.shape[1]
-
-    def _generate_first_rest(self,
-                             activity: bool = True,
+            if not downsampled:
+                new_exc_activity = self.wc.exc[:, slc]
+                new_inh_activity = self.wc.inh[:, slc]
+                num_raw = self.wc.exc.shape[1]
+            self._store_activity(new_exc_activity, new_inh_activity, num_raw,
+                                 start_idx, sampling_rate_dt, syn_act=syn_act)
+        if self._raw_required:
+            self._pending_chunk["exc"] = self.wc.exc
+            self._pending_chunk["inh"] = self.wc.inh
+
+    def _generate_all_blocks(self,
                              a_s_rate: float = 0.02,
                              syn_act: bool = True):
-        """ Wrapper for first resting state block """
-        # first block in design always started with resting state
+        """ Integrate all blocks of the design with one numba kernel call,
+        coupling matrix is switched inside the kernel at the block boundaries.
+        Only downsampled activity is saved, raw activity is not kept """
+        schedule = self._block_schedule()
+        segments = [(Cmat, int(round(duration * 1000 / self._dt)))
+                    for Cmat, duration, _ in schedule]
+        # model params are left as after integration of the last block
+        self.wc.params['Cmat'] = schedule[-1][0]
+        self.wc.params['duration'] = schedule[-1][1] * 1000
+        sampling_rate_dt, start_idx = self._activity_grid(a_s_rate)
+        new_exc_activity, new_inh_activity, num_raw = self._run_numba(
+            start_idx, sampling_rate_dt, segments=segments)
+        self._store_activity(new_exc_activity, new_inh_activity, num_raw,
+                             start_idx, sampling_rate_dt, syn_act=syn_act)
+        for _, _, time_idxs in schedule:
+            for key, start_time, end_time in time_idxs:
+                self.time_idxs_dict[key].append((start_time, end_time))
+        self.wc.t = []
+        self.wc.outputs = dotdict()
+        self.wc.state = dotdict()
+
+    def _block_seed(self) -> int:
+        """ Seed for the noise of the next block integrated with wc.run,
+        blocks get different seeds spawned from the model seed (read at the
+        first block), so noise is not repeated in each block """
+        if self._seed_seq is None:
+            self._seed_seq = np.random.SeedSequence(self.wc.params['seed'])
+        return int(self._seed_seq.spawn(1)[0].generate_state(1)[0])
+
+    def _noise_rng(self) -> np.random.Generator:
+        """ Generator of noise for numba integration, created from
+        the model seed at the first block and continued in the next blocks """
+        if self._rng is None:
+            self._rng = np.random.default_rng(self.wc.params['seed'])
+        return self._rng
+
+    def _activity_grid(self, a_s_rate: float) -> tuple[int, int]:
+        """ Number of integration steps between saved activity points and
+        index of the first saved point in the next integrated block """
+        self.activity["sampling_rate"] = a_s_rate
+        if a_s_rate not in self._cached_srdt:
+            self._cached_srdt[a_s_rate] = int(round(1000 * a_s_rate / self._dt))
+        sampling_rate_dt = self._cached_srdt[a_s_rate]
+        # same downsampling slice for all series, continues previous block
+        start_idx = sampling_rate_dt - (self.activity["idx_last_t"] - 1) % sampling_rate_dt
+        return sampling_rate_dt, start_idx
+
+    def _store_activity(self,
+                        new_exc_activity: npt.NDArray,
+                        new_inh_activity: npt.NDArray,
+                        num_raw: int,
+                        start_idx: int,
+                        sampling_rate_dt: int,
+                        syn_act: bool = True):
+        """ Append downsampled activity of integrated block(s) with num_raw
+        integration steps to saved activity """
+        idx_last_t = self.activity["idx_last_t"]
+        if syn_act:
+            # synaptic activity only for the stored time points
+            new_sa_activity = self._syn_act_downsampled(new_exc_activity,
+                                                        new_inh_activity)
+        num_new = new_exc_activity.shape[1]
+
+        # write block into preallocated buffers (casting to their dtypes),
+        # series are views up to cursor
+        self._reserve_activity(num_new, syn_act=syn_act)
+        start, end = self._cursor, self._cursor + num_new
+        self._exc_buf[:, start:end] = new_exc_activity
+        self._inh_buf[:, start:end] = new_inh_activity
+        # time (in ms) of the saved points from their integration step indexes
+        self._t_buf[start:end] = self._dt * (idx_last_t + start_idx
+                                             + sampling_rate_dt * np.arange(num_new))
+        if syn_act:
+            self._sa_buf[:, start:end] = new_sa_activity
+            self.activity["sa_series"] = self._sa_buf[:, :end]
+        self._cursor = end
+        self.activity["exc_series"] = self._exc_buf[:, :end]
+        self.activity["inh_series"] = self._inh_buf[:, :end]
+        self.activity["t"] = self._t_buf[:end]
+        self.activity["idx_last_t"] = idx_last_t + num_raw
+
+    def _release_raw(self):
+        """ Drop references to raw activity of the last block, if clear_raw
+        was requested, also from the model outputs """
+        self._pending_chunk["exc"] = None
+        self._pending_chunk["inh"] = None
+        if self._clear_raw:
+            self.wc.exc = []
+            self.wc.inh = []
+            self.wc.outputs.pop("exc", None)
+            self.wc.outputs.pop("inh", None)
+
+    def time_idxs(self, round_to: int = 3) -> dict[str, list[tuple[float, float]]]:
+        """ Start and end times (in sec) of all blocks by task name,
+        rounded to round_to digits
+
+        Args:
+            round_to (int): number of decimals
+
+        Returns:
+            dict with list of (start, end) tuples for each task and rest
+        """
+        return {k: [(round(a, round_to), round(b, round_to)) for a, b in v]
+                for k, v in self.time_idxs_dict.items()}
+
+    def _merged_task_blocks(self) -> list[list[int]]:
+        """ Indices of task blocks grouped into runs of the same task
+        without rest gap between them, each run is integrated as one block """
+        blocks = [[0]] if self.onset_time_list else []
+        for i in range(1, len(self.onset_time_list)):
+            prev = blocks[-1][-1]
+            same_task = self.task_name_list[i] == self.task_name_list[prev]
+            no_gap = np.isclose(self.onset_time_list[i],
+                                self.onset_time_list[prev] + self.duration_list[prev])
+            if same_task and no_gap:
+                blocks[-1].append(i)
+            else:
+                blocks.append([i])
+        return blocks
+
+    def _block_schedule(self) -> list[tuple[npt.NDArray, float, list[tuple[str, float, float]]]]:
+        """ All blocks in the order they are integrated in generate_full_series
+        as (coupling matrix, duration in sec, [(task name, start, end), ...]),
+        rest gaps between tasks included """
         if self.rest_before:
             start_time_rest = -self.first_duration
-            duration = -start_time_rest + self.onset_time_list[0]
-            end_time_rest = self.onset_time_list[0]
         else:
             start_time_rest = 0
-            duration = self.onset_time_list[0]
-            end_time_rest = self.onset_time_list[0]
-        Cmat = self.Wij_rest
-        self._generate_single_block(Cmat,
-                                    duration=duration,
-                                    activity=activity,
-                                    a_s_rate=a_s_rate,
-                                    syn_act=syn_act)
-        self.time_idxs_dict["Rest"].append([round(start_time_rest, 3),
-                                            round(end_time_rest, 3)])
-
-    def _generate_last_rest(self,
-                            activity: bool = True,
-                            a_s_rate: float = 0.02,
-                            syn_act: bool = True):
-        """ Wrapper for last resting state block """
-        start_time_rest = self.onset_time_list[-1] + self.duration_list[-1]
-        Cmat = self.Wij_rest
-        # set last rest duration equal to previous gap between onset times
-        duration = self.last_duration
-        end_time_rest = start_time_rest + duration
-        self._generate_single_block(Cmat,
-                                    duration=duration,
-                                    activity=activity,
-                                    a_s_rate=a_s_rate, syn_act=syn_act)
-        self.time_idxs_dict["Rest"].append([round(start_time_rest, 3),
-                                            round(end_time_rest, 3)])
+        end_time_rest = self.onset_time_list[0]
+        schedule = [(self.Wij_rest, end_time_rest - start_time_rest,
+                     [("Rest", start_time_rest, end_time_rest)])]
+        for block in self._merged_task_blocks():
+            first, last = block[0], block[-1]
+            task_name = self.task_name_list[first]
+            end_time_block = self.onset_time_list[last] + self.duration_list[last]
+            schedule.append((self._cmats[self._task_codes[first]],
+                             end_time_block - self.onset_time_list[first],
+                             [(task_name, self.onset_time_list[i],
+                               self.onset_time_list[i] + self.duration_list[i])
+                              for i in block]))
+            if last < len(self.onset_time_list) - 1:
+                gap = (self.onset_time_list[last + 1] - self.onset_time_list[last]
+                       - self.duration_list[last])
+                if gap > 0:
+                    schedule.append((self.Wij_rest, gap,
+                                     [("Rest", end_time_block, self.onset_time_list[last + 1])]))
+            else:
+                schedule.append((self.Wij_rest, self.last_duration,
+                                 [("Rest", end_time_block, end_time_block + self.last_duration)]))
+        return schedule
+
+    def _block_durations(self) -> list[float]:
+        """ Durations (in sec) of all blocks in the order they are integrated
+        in generate_full_series, rest gaps between tasks included """
+        return [duration for _, duration, _ in self._block_schedule()]
+
+    def _precompute_output_length(self, a_s_rate: float) -> int:
+        """ Upper bound for the number of activity samples saved
+        by generate_full_series with sampling rate a_s_rate (in sec) """
+        sampling_rate_dt = int(round(1000 * a_s_rate / self._dt))
+        return sum(int(np.ceil(1000 * duration / self._dt / sampling_rate_dt)) + 1
+                   for duration in self._block_durations())
+
+    def _reserve_activity(self, num_samples: int, syn_act: bool = True):
+        """ Make sure activity buffers can store num_samples after the cursor,
+        buffers are reallocated (with doubling) only if they are too short """
+        capacity = 0 if self._exc_buf is None else self._exc_buf.shape[1]
+        if (self._cursor + num_samples <= capacity
+                and (self._sa_buf is not None or not syn_act)):
+            return
+        N = self.wc.params["N"]
+        new_capacity = max(self._cursor + num_samples, 2 * capacity)
+
+        def grow(buf, shape, dtype):
+            new_buf = np.empty(shape, dtype=dtype)
+            if buf is not None:
+                new_buf[..., :self._cursor] = buf[..., :self._cursor]
+            return new_buf
+
+        self._exc_buf = grow(self._exc_buf, (N, new_capacity), self.activity_dtype)
+        self._inh_buf = grow(self._inh_buf, (N, new_capacity), self.activity_dtype)
+        self._t_buf = grow(self._t_buf, (new_capacity,), np.float64)
+        if syn_act or self._sa_buf is not None:
+            self._sa_buf = grow(self._sa_buf, (N, new_capacity), self.sa_dtype)
+
+    def _numba_coupling_arrays(self, Cmat: npt.NDArray):
+        """ CSR form of coupling matrix and delays (in steps) for each its value """
+        if id(Cmat) not in self._numba_coupling:
+            Cmat_csr = self._sparse_cmats.get(id(Cmat))
+            if Cmat_csr is None:
+                Cmat_csr = sparse.csr_matrix(Cmat)
+            rows = np.repeat(np.arange(Cmat.shape[0]), np.diff(Cmat_csr.indptr))
+            # dense matrix is kept in the entry, so its id can not be reused
+            self._numba_coupling[id(Cmat)] = (
+                Cmat, Cmat_csr, self._Dmat_steps[rows, Cmat_csr.indices])
+        return self._numba_coupling[id(Cmat)][1:]
+
+    def _run_numba(self, start: int = 0, stride: int = 1,
+                   segments: Optional[list[tuple[npt.NDArray, int]]] = None):
+        """ Integrate current block with numba kernel instead of wc.run.
+        Initial values for the next block are stored in the same way
+        as neurolib does with continue_run=True. With stride 1 the raw activity
+        is stored to the model outputs, otherwise only every stride step
+        starting from start is returned and model outputs are cleared
+
+        Args:
+            start (int): first integration step saved
+            stride (int): step between saved integration steps
+            segments (list of tuples): consecutive blocks integrated in one call,
+                as (coupling matrix, number of steps), by default one block
+                with current Cmat and duration from model params
+
+        Returns:
+            excitatory and inhibitory activity, number of integration steps
+        """
+        params = self.wc.params
+        N = params['N']
+        startind = int(np.max(self._Dmat_steps)) + 1
+        if segments is None:
+            segments = [(params['Cmat'], int(round(params['duration'] / self._dt)))]
+        # distinct coupling matrices and index of the matrix for each segment
+        mat_idx, mats = {}, []
+        for Cmat, _ in segments:
+            if id(Cmat) not in mat_idx:
+                mat_idx[id(Cmat)] = len(mats)
+                mats.append(Cmat)
+        seg_mats = np.array([mat_idx[id(Cmat)] for Cmat, _ in segments], dtype=np.int32)
+        seg_ends = np.cumsum([n for _, n in segments], dtype=np.int64)
+        n_steps = int(seg_ends[-1])
+        if self._sparse_cmats:
+            # only existing connections are looped, all matrices in the same arrays
+            cmats = np.empty((0, N, N))
+            indptr, indices, data, delays = [], [], [], []
+            nnz = 0
+            for Cmat in mats:
+                Cmat_csr, Cmat_delays = self._numba_coupling_arrays(Cmat)
+                indptr.append(Cmat_csr.indptr + nnz)
+                indices.append(Cmat_csr.indices)
+                data.append(Cmat_csr.data)
+                delays.append(Cmat_delays)
+                nnz += Cmat_csr.nnz
+            indptr = np.array(indptr, dtype=np.int32)
+            indices = np.concatenate(indices).astype(np.int32, copy=False)
+            data = np.concatenate(data).astype(np.float64, copy=False)
+            delays = np.concatenate(delays).astype(np.int32, copy=False)
+        else:
+            cmats = np.array(mats, dtype=np.float64)
+            indptr = np.zeros((0, N + 1), dtype=np.int32)
+            indices = np.zeros(0, dtype=np.int32)
+            data = np.zeros(0)
+            delays = np.zeros(0, dtype=np.int32)
+
+        # history of the last max delay steps, time-major
+        if params['exc_init'].shape[1] == 1:
+            exc_hist = np.repeat(params['exc_init'].T, startind, axis=0).astype(np.float64)
+            inh_hist = np.repeat(params['inh_init'].T, startind, axis=0).astype(np.float64)
+        else:
+            exc_hist = np.array(params['exc_init'][:, -startind:].T, dtype=np.float64, order='C')
+            inh_hist = np.array(params['inh_init'][:, -startind:].T, dtype=np.float64, order='C')
+        exc_ou = np.array(params['exc_ou'], dtype=np.float64)
+        inh_ou = np.array(params['inh_ou'], dtype=np.float64)
+
+        rng = self._noise_rng()
+        num_out = len(range(start, n_steps, stride))
+        exc = np.empty((N, num_out))
+        inh = np.empty((N, num_out))
+        wc_step(exc_hist, inh_hist, cmats, self._Dmat_steps, indptr, indices, data, delays,
+                seg_mats, seg_ends, exc_ou, inh_ou, pack_params(params), rng, n_steps,
+                exc, inh, start, stride)
+
+        if stride == 1 and start == 0:
+            if self.append_outputs and 'exc' in self.wc.outputs:
+                exc_out = np.hstack((self.wc.outputs['exc'], exc))
+                inh_out = np.hstack((self.wc.outputs['inh'], inh))
+            else:
+                exc_out, inh_out = exc, inh
+            self.wc.outputs['exc'] = exc_out
+            self.wc.outputs['inh'] = inh_out
+            self.wc.exc = exc_out
+            self.wc.inh = inh_out
+        else:
+            # raw activity of the block is not available
+            self.wc.outputs.pop('exc', None)
+            self.wc.outputs.pop('inh', None)
+            self.wc.exc = []
+            self.wc.inh = []
+        params['exc_init'] = exc_hist.T
+        params['inh_init'] = inh_hist.T
+        params['exc_ou'] = exc_ou
+        params['inh_ou'] = inh_ou
+        return exc, inh, n_steps
 
     def generate_full_series(self,
                              bold_chunkwise: bool = True,
@@ -421,11 +774,14 @@ class WCTaskSim:
         object with BOLD and activity parameters filled
         """
 
+        self._refresh_dt()
         # set up bold parameters
         self.output_activation = output_activation
         self.normalize_max = normalize_max
         self.fix_bold = fix_bold
         self.TR = TR
+        self._clear_raw = clear_raw
+        self._raw_required = bold_chunkwise or not clear_raw
         if bold_chunkwise:
             self.bold_input_ready = True
             self.append_outputs = False
@@ -434,107 +790,93 @@ class WCTaskSim:
                       "set to False")
             self.bold = False
             self.chunkwise = False
-            chunksize = TR * 1000 / self.wc.params["dt"]
+            chunksize = TR * 1000 / self._dt
         if self.output_activation != 'exc':
             syn_act = True
         else:
             syn_act = False
-        self._generate_first_rest(activity=activity, a_s_rate=a_s_rate, syn_act=syn_act)
-
-        if bold_chunkwise:
-            assert self.wc['exc'].shape[1] >= chunksize, \
-                "First rest series should be longer than TR"
-            self.generate_bold_chunkwise(TR=TR,
-                                         input_type=self.output_activation,
-                                         normalize_max=normalize_max,
-                                         is_first=True,
-                                         fix=self.fix_bold,
-                                         **kwargs)
-
-        for i in range(len(self.onset_time_list)):
-            task_name = self.task_name_list[i]
-            Cmat = self.Wij_task_dict[task_name]
-            onset_time = self.onset_time_list[i]
-            duration = self.duration_list[i]
-            start_time_block = onset_time
+        if activity:
+            self._reserve_activity(self._precompute_output_length(a_s_rate),
+                                   syn_act=syn_act)
+        if (self.use_numba and activity and not self._raw_required
+                and not (self.bold or self.chunkwise)):
+            # nothing is needed between blocks, all of them in one kernel call
+            self._generate_all_blocks(a_s_rate=a_s_rate, syn_act=syn_act)
+            return
+        for i, (Cmat, duration, intervals) in enumerate(self._block_schedule()):
             self._generate_single_block(Cmat,
                                         duration=duration,
                                         activity=activity,
                                         a_s_rate=a_s_rate,
                                         syn_act=syn_act)
+            # merged blocks are still stored separately
+            for name, start_time, end_time in intervals:
+                self.time_idxs_dict[name].append((start_time, end_time))
             if bold_chunkwise:
+                if i == 0:
+                    assert self.wc['exc'].shape[1] >= chunksize, \
+                        "First rest series should be longer than TR"
                 self.generate_bold_chunkwise(TR=TR,
                                              input_type=self.output_activation,
                                              normalize_max=normalize_max,
-                                             is_first=False,
+                                             is_first=i == 0,
                                              fix=self.fix_bold,
                                              **kwargs)
-            end_time_block = onset_time + duration
-            self.time_idxs_dict[task_name].append([round(start_time_block, 3),
-                                                   round(end_time_block, 3)])
-            if i < len(self.onset_time_list) - 1:
-                duration = self.onset_time_list[i + 1] - \
-                           self.onset_time_list[i] - self.duration_list[i]
-                if duration > 0:
-                    Cmat = self.Wij_rest
-                    start_time_rest = self.onset_time_list[i] + self.duration_list[i]
-                    end_time_rest = self.onset_time_list[i + 1]
-                    self._generate_single_block(Cmat,
-                                                duration=duration,
-                                                activity=activity,
-                                                a_s_rate=a_s_rate,
-                                                syn_act=syn_act)
-                    if bold_chunkwise:
-                        self.generate_bold_chunkwise(TR=TR,
-                                                     input_type=self.output_activation,
-                                                     normalize_max=normalize_max,
-                                                     is_first=False,
-                                                     fix=self.fix_bold,
-                                                     **kwargs)
-                    self.time_idxs_dict["Rest"].append([round(start_time_rest, 3),
-                                                        round(end_time_rest, 3)])
-            else:
-                self._generate_last_rest(activity=activity,
-                                         a_s_rate=a_s_rate,
-                                         syn_act=syn_act)
-                if bold_chunkwise:
-                    self.generate_bold_chunkwise(TR=TR,
-                                                 input_type=self.output_activation,
-                                                 normalize_max=normalize_max,
-                                                 is_first=False,
-                                                 fix=self.fix_bold,
-                                                 **kwargs)
-
-            if clear_raw:
-                self.wc.exc = []
-                self.wc.inh = []
+            if i == 0:
+                continue
+            # raw activity is already released after bold generation
+            if clear_raw and not bold_chunkwise:
+                self._release_raw()
             self.wc.t = []
             self.wc.outputs = dotdict()
             self.wc.state = dotdict()
-
-    def generate_neuronal_oscill(self):
+        if bold_chunkwise:
+            # rest of the signal shorter than TR is kept, the buffer is not
+            self.input_rest = self.input_rest.copy()
+            self._carry = None
+            self._carry_len = 0
+
+    def generate_neuronal_oscill(self,
+                                 exc: Optional[npt.NDArray] = None,
+                                 inh: Optional[npt.NDArray] = None):
         """ function for computing integrated synaptic
         activity (without integration over 50ms)
         as described in Horwitz and Tagamets (1999)
         IN = wEE*E + WEI*E+WIE*IE +C*E
 
         Args:
-            source (string): basis for computing isa series,
-             possible values raw or act
+            exc (np.ndarray): excitatory activity, default raw activity of wc model
+            inh (np.ndarray): inhibitory activity, default raw activity of wc model
 
         Returns:
             isa_series: np.array with the same shape as input activity
         """
-        ee = self.wc.params['c_excexc']
-        ei = self.wc.params['c_excinh']
-        ie = self.wc.params['c_inhexc']
-        ii = self.wc.params['c_inhinh']
-
-        exc = self.wc.exc
-        inh = self.wc.inh
-        sa = ee * exc + ei * exc + ie * inh + ii * inh + self.wc.Cmat @ exc
+        alpha = self.wc.params['c_excexc'] + self.wc.params['c_excinh']
+        beta = self.wc.params['c_inhexc'] + self.wc.params['c_inhinh']
+
+        exc = self.wc.exc if exc is None else exc
+        inh = self.wc.inh if inh is None else inh
+        Cmat = self._sparse_cmats.get(id(self.wc.Cmat), self.wc.Cmat)
+        # terms are accumulated into the product, only one temporary at a time
+        sa = Cmat @ exc
+        sa += alpha * exc
+        sa += beta * inh
         return sa
 
+    def _syn_act_downsampled(self, exc_ds: npt.NDArray, inh_ds: npt.NDArray):
+        """ Synaptic activity as in generate_neuronal_oscill computed only
+        for the downsampled time points of activity """
+        alpha = self.wc.params['c_excexc'] + self.wc.params['c_excinh']
+        beta = self.wc.params['c_inhexc'] + self.wc.params['c_inhinh']
+        Cmat = self._sparse_cmats.get(id(self.wc.Cmat), self.wc.Cmat)
+        return alpha * exc_ds + beta * inh_ds + Cmat @ exc_ds
+
+    def _load_mat(self, mat_path: str) -> dict:
+        """ Load mat file once per instance, next calls reuse its content """
+        if mat_path not in self._mat_cache:
+            self._mat_cache[mat_path] = io.loadmat(mat_path)
+        return self._mat_cache[mat_path]
+
     def generate_coactivation_by_mat(self,
                                      mat_path,
                                      act_scaling,
@@ -562,23 +904,20 @@ class WCTaskSim:
         last_rest = self.last_duration
         TR = self.TR
         #dt = self.wc.params["dt"]
-        input_data = io.loadmat(mat_path)
+        input_data = self._load_mat(mat_path)
         num_tasks = input_data['onsets'].shape[1]
-        onsets_list = []
-        activations = []
-        durations_list = []
-        for i in range(num_tasks):
-            onsets_list.append(list(input_data['onsets'][0, i].squeeze()))
-            activations.append(input_data['activations'][0, i].squeeze())
-            durations_list.append(input_data["durations"][0, i].squeeze())
+        onsets_list = [input_data['onsets'][0, i].ravel().tolist() for i in range(num_tasks)]
+        # indicator of module response to each task, shape (num_tasks, num_modules)
+        acts_mat = np.stack([np.atleast_1d(input_data['activations'][0, i].squeeze()) > 0
+                             for i in range(num_tasks)]).astype(float)
+        durations_list = [input_data["durations"][0, i].squeeze() for i in range(num_tasks)]
 
         box_car_activations = create_task_design_activation(onsets_list,
                                                             durations_list,
                                                             dt=dt,
                                                             first_rest=first_rest,
                                                             last_rest=last_rest)
-        activations_by_module = create_activations_per_module(activations,
-                                                              box_car_activations)
+        activations_by_module = acts_mat.T @ box_car_activations
         activations_by_regions = create_reg_activations(activations_by_module,
                                                         num_regions,
                                                         num_regions_per_modules)
@@ -606,18 +945,33 @@ class WCTaskSim:
                                act_scaling=0.5,
                                all_rois=True,
                                fix_bold=True,
+                               as_view=False,
                                **kwargs):
+        """ Co-activations of modules convolved with hrf, onsets and activations from mat file
+
+        Args:
+            mat_path (str): path to matfile
+            act_scaling (float): scaling factor for hrf function
+            all_rois (bool): if True, module series are repeated for each region of module
+            fix_bold (bool): fixed parameters of BW model
+            as_view (bool): with all_rois, return read-only views with shape
+                (num_modules, N // num_modules, T) instead of (N, T) copies
+            **kwargs: kwargs for bw_convolve
+
+        Returns:
+            time points, resampled activations and bold
+        """
         N = self.wc.params["N"]
         first_rest = self.first_duration
         last_rest = self.last_duration
         TR = self.TR
         dt = self.wc.params["dt"]
-        input_data = io.loadmat(mat_path)
+        input_data = self._load_mat(mat_path)
         task_duration = float(input_data["durations"][0, 0].squeeze())
 
         onset_taskA = list(input_data['onsets'][0, 0].squeeze().round(2))
         onset_taskB = list(input_data['onsets'][0, 1].squeeze().round(2))
-        onset_taskAB, _, _ = read_onsets_from_mat(mat_path)
+        onset_taskAB, _, _ = read_onsets_from_mat(mat_path, input_data=input_data)
         onset_taskAB = list(onset_taskAB)
         activations_A = input_data['activations'][0][0].squeeze()
         activations_B = input_data['activations'][0][1].squeeze()
@@ -644,7 +998,12 @@ class WCTaskSim:
         hrf.bw_convolve(local_activation, append=False, **kwargs)
         t_res_activ, res_activ = hrf.resample_to_TR(local_activation)
 
-        if all_rois:
+        if all_rois and as_view:
+            # rows of each module are the same memory (zero stride)
+            return (t_res_activ,
+                    _tile_rows(res_activ, N // self.num_modules),
+                    _tile_rows(hrf.BOLD, N // self.num_modules))
+        elif all_rois:
             return t_res_activ, np.repeat(res_activ,
                                           repeats=N // self.num_modules, axis=0), np.repeat(hrf.BOLD,
                                                                                             repeats=N // self.num_modules,
@@ -679,16 +1038,18 @@ class WCTaskSim:
 
         assert input_type in ['exc', 'sum', 'syn_act'], "input type could be 'exc', 'sum' or 'syn_act'"
         if is_first:
-            input_rest = np.array([], dtype=np.float64).reshape(N, 0)
-        else:
-            input_rest = self.input_rest
+            self._carry_len = 0
+        # raw activity handed over by the last generated block
+        exc = self._pending_chunk["exc"]
+        inh = self._pending_chunk["inh"]
+        if exc is None:
+            exc, inh = self.wc['exc'], self.wc['inh']
         if input_type == 'exc':
-            new_exc = np.hstack((input_rest, self.wc['exc']))
+            new_exc = exc
         elif input_type == 'sum':
-            new_exc = np.hstack((input_rest, self.wc['exc'] + self.wc['inh']))
+            new_exc = exc + inh
         elif input_type == 'syn_act':
-            new_exc = np.hstack((input_rest, self.generate_neuronal_oscill()))
-
+            new_exc = self.generate_neuronal_oscill(exc, inh)
         if is_first:
             self.hrf = HRF(N,
                            dt=dt,
@@ -697,39 +1058,52 @@ class WCTaskSim:
                            normalize_max=normalize_max,
                            fix=fix)
 
-        if new_exc.shape[1] > chunksize:
-            used_last_idxs = int(new_exc.shape[1] - new_exc.shape[1] % chunksize)
-            self.input_rest = new_exc[:, used_last_idxs:]
-            bold_input = new_exc[:, :used_last_idxs]
-
-            if is_first:
-                self.hrf.bw_convolve(bold_input, append=False, **kwargs)
-            else:
-                self.hrf.bw_convolve(bold_input, append=True, **kwargs)
+        # signal is fed in TR slices through the buffer of one TR length,
+        # rest of the signal stays there till the next block
+        width = int(np.ceil(chunksize))
+        if (self._carry is None or self._carry.shape[0] != N
+                or self._carry.shape[1] != width):
+            self._carry = np.empty((N, width))
+        total = self._carry_len + new_exc.shape[1]
+        used = int(total - total % chunksize) if total > chunksize else 0
+        pos, done = 0, 0
+        while done < used:
+            take = min(width - self._carry_len, used - done - self._carry_len)
+            self._carry[:, self._carry_len:self._carry_len + take] = new_exc[:, pos:pos + take]
+            pos += take
+            self._carry_len += take
+            self.hrf.bw_convolve(self._carry[:, :self._carry_len],
+                                 append=not (is_first and done == 0), **kwargs)
+            done += self._carry_len
+            self._carry_len = 0
+        rest = new_exc.shape[1] - pos
+        self._carry[:, self._carry_len:self._carry_len + rest] = new_exc[:, pos:]
+        self._carry_len += rest
+        if used:
             self.BOLD = self.hrf.BOLD
             self.t_BOLD = self.hrf.t_BOLD
-        else:
-            self.input_rest = new_exc
+        # raw activity is not needed anymore
+        del exc, inh, new_exc
+        self._release_raw()
+        self.input_rest = self._carry[:, :self._carry_len]
 
     def draw_envelope_bold_compare(self, node_id=2, series_name='sa_series',
                                    low_f=10, high_f=50, low_pass=None,
-                                   drop_first_sec=7, shift_sec=4, plot_first=1, to_plot=True):
+                                   drop_first_sec=7, shift_sec=4, plot_first=1, to_plot=True,
+                                   return_sweep=None):
 
         a_s_rate = self.activity["sampling_rate"]
         TR = self.TR
-        nyquist = 1 / a_s_rate / 2
         plot_first_dt = int(plot_first / a_s_rate)
         raw_signal = self.activity[series_name][node_id, :]
-        high_band = high_f / nyquist
-        low_band = low_f / nyquist
-        b1, a1 = signal.butter(4, [low_band, high_band], btype='bandpass')
+        # sosfiltfilt needs a writable sos, the cached one is read-only
+        sos1 = _get_sos(4, low_f, high_f, a_s_rate, 'bandpass').copy()
 
-        emg_filtered = signal.filtfilt(b1, a1, raw_signal)
+        emg_filtered = signal.sosfiltfilt(sos1, raw_signal)
 
         if low_pass is not None:
-            low_pass = low_pass / nyquist
-            b2, a2 = signal.butter(4, low_pass, btype='lowpass')
-            hilbert_envelope = signal.filtfilt(b2, a2, abs(emg_filtered))
+            sos2 = _get_sos(4, low_pass, None, a_s_rate, 'lowpass').copy()
+            hilbert_envelope = signal.sosfiltfilt(sos2, abs(emg_filtered))
         else:
             hilbert_envelope = np.abs(signal.hilbert(emg_filtered))
             # plt.plot(emg_envelope)
@@ -737,19 +1111,27 @@ class WCTaskSim:
         drop_first_sec_TR = int(drop_first_sec / TR)
         drop_first_sec_dt = int(drop_first_sec / a_s_rate)
         step = int(TR / a_s_rate)
-        bold_scaled = normalize(self.BOLD[node_id, drop_first_sec_TR:]).flatten()
-        # compute all shifts
-        shift_list_sec = list(np.linspace(-3, 7, 41))
-        rcoeff_list = []
-        for shift in shift_list_sec:
-            shift = int(shift / a_s_rate)
-            env_scaled_shifted = normalize(hilbert_envelope[drop_first_sec_dt - shift::step]).flatten()
-            sig_len = min(len(env_scaled_shifted), len(bold_scaled))
-            rcoeff, p_val = stats.pearsonr(env_scaled_shifted[:sig_len], bold_scaled[:sig_len])
-            rcoeff_list.append(rcoeff)
+        bold_scaled = normalize(self.BOLD[node_id, drop_first_sec_TR:]).ravel()
+        if return_sweep is None:
+            return_sweep = to_plot
+        shift_list_sec, rcoeff_list = [], []
+        if return_sweep:
+            # compute all shifts at once, each shifted envelope is a row
+            # compared with bold on the common length
+            shift_list_sec = list(np.linspace(-3, 7, 41))
+            shifts = (np.array(shift_list_sec) / a_s_rate).astype(int)
+            shifted = [hilbert_envelope[drop_first_sec_dt - shift::step] for shift in shifts]
+            sig_lens = np.minimum([len(env) for env in shifted], len(bold_scaled))
+            env_centered = np.zeros((len(shifts), len(bold_scaled)))
+            for i, env in enumerate(shifted):
+                env_centered[i, :sig_lens[i]] = env[:sig_lens[i]] - env[:sig_lens[i]].mean()
+            bold_sum = np.cumsum(bold_scaled)[sig_lens - 1]
+            bold_sq_sum = np.cumsum(bold_scaled ** 2)[sig_lens - 1]
+            rcoeff_list = list((env_centered @ bold_scaled) / np.sqrt(
+                np.sum(env_centered ** 2, axis=1) * (bold_sq_sum - bold_sum ** 2 / sig_lens)))
 
         shift = int(shift_sec / a_s_rate)
-        env_scaled_shifted = normalize(hilbert_envelope[drop_first_sec_dt - shift::step]).flatten()
+        env_scaled_shifted = normalize(hilbert_envelope[drop_first_sec_dt - shift::step]).ravel()
         sig_len = min(len(env_scaled_shifted), len(bold_scaled))
         rcoeff, p_val = stats.pearsonr(env_scaled_shifted[:sig_len], bold_scaled[:sig_len])
         time = np.arange(sig_len) * TR
@@ -794,59 +1176,67 @@ class WCTaskSim:
         N_ROIs = activity.shape[0]
         s_rate = self.activity["sampling_rate"]
         coeff = 1 / s_rate
-        zero_shift = self.time_idxs_dict["Rest"][0][0]
-        len_tasks = int(np.ceil(coeff * (self.time_idxs_dict["Rest"][-1][1] - zero_shift)))
+        time_idxs_dict = self.time_idxs()
+        zero_shift = time_idxs_dict["Rest"][0][0]
+        len_tasks = int(np.ceil(coeff * (time_idxs_dict["Rest"][-1][1] - zero_shift)))
         assert len_tasks <= activity.shape[1], 'Computed length and series len should be less or equal'
         if len_tasks < activity.shape[1]:
             activity = activity[:,:len_tasks]
             act_time = self.activity['t'][:len_tasks]
-        task_type = np.array(['Rest'] * int(len_tasks))
-        trial_time_point = -1 + np.zeros(int(len_tasks), dtype=int)
+        trial_time_point = np.full(int(len_tasks), -1, dtype=np.int32)
         tasks = ["Task_A", "Task_B"]
-        trial_number = -1 + np.zeros(int(len_tasks), dtype=int)
-        for task in tasks:
-            for i in range(len(self.time_idxs_dict[task])):
-                idx_start = int((self.time_idxs_dict[task][i][0] - zero_shift) * coeff)
-                idx_end = int((self.time_idxs_dict[task][i][1] - zero_shift) * coeff)
-                task_type[idx_start:idx_end] = task.split('_')[-1]
-                trial_number[idx_start:idx_end] = int(i)
-                trial_time_point[idx_start:idx_end] = np.arange(idx_end - idx_start)
-
-        roi_idx1, roi_idx2 = np.triu_indices(N_ROIs, k=1)
-        # phase_diffs = np.zeros((roi_idx1.shape[0], int(len_tasks)), dtype=complex)
-        phase_diffs = np.zeros((roi_idx1.shape[0], int(len_tasks)))
-        nyquist = 1 / s_rate / 2
-        high_band = high_f / nyquist
-        low_band = low_f / nyquist
-        b1, a1 = signal.butter(4, [low_band, high_band], btype='bandpass')
-        filtered_data = signal.filtfilt(b1, a1, activity)
-        analytic_data = signal.hilbert(filtered_data)
-        angles = np.angle(analytic_data)
-        for r in range(roi_idx1.shape[0]):
-            # phase_diffs[r, :] = np.exp(1j * (angles[roi_idx1[r], :] - angles[roi_idx2[r], :]))
-            phase_diffs[r, :] = angles[roi_idx1[r], :] - angles[roi_idx2[r], :]
-        act_dict = {'activity': activity, 'phase_diff': phase_diffs,
-                    'time': act_time, 's_rate': s_rate, 'task_type': task_type,
-                    'trial_time': trial_time_point, 'trial_number': trial_number}
+        trial_number = np.full(int(len_tasks), -1, dtype=np.int32)
+        # task codes are indexes in labels, 0 for rest
+        labels = np.array(['Rest'] + [task.split('_')[-1] for task in tasks])
+        task_code = np.zeros(int(len_tasks), dtype=np.int8)
+        intervals = np.array([[(start - zero_shift) * coeff, (end - zero_shift) * coeff, code, i]
+                              for code, task in enumerate(tasks, start=1)
+                              for i, (start, end) in enumerate(time_idxs_dict[task])])
+        intervals = intervals.astype(np.int64).reshape(-1, 4)
+        fill_task_labels(intervals, task_code, trial_number, trial_time_point)
+        task_type = labels[task_code]
+
+        roi_idx1, roi_idx2 = _triu_pairs(N_ROIs)
+        # single precision is enough for phases and halves the memory traffic
+        phase_diffs = np.empty((roi_idx1.shape[0], int(len_tasks)), dtype=np.float32)
+        # sosfiltfilt needs a writable sos, the cached one is read-only
+        sos = _get_sos(4, low_f, high_f, s_rate, 'bandpass').copy()
+        # filtered and complex analytic signals exist only for a block of regions
+        # at a time, so only angles have the full size
+        angles = np.empty(activity.shape, dtype=np.float32)
+        rows_per_block = max(1, 2 ** 22 // angles.shape[1])
+        # rows of the block are transformed by all cores
+        with sp_fft.set_workers(-1):
+            for start in range(0, N_ROIs, rows_per_block):
+                rows = slice(start, start + rows_per_block)
+                filtered_data = signal.sosfiltfilt(sos, activity[rows], axis=-1)
+                analytic_data = signal.hilbert(filtered_data)
+                np.arctan2(analytic_data.imag, analytic_data.real, out=angles[rows])
+                del filtered_data, analytic_data
+        pair_phase_diff(angles, roi_idx1, roi_idx2, phase_diffs)
         if return_xr:
-            act_vars = {'neural_activity': (['region', 'time'], act_dict['activity'],
+            # task_type is fixed-width string array, not object
+            act_vars = {'neural_activity': (['region', 'time'], activity,
                                             {'long_name': 'wc simulated wc neural activity'}),
-                        'phase_diff': (['reg_reg', 'time'], act_dict['phase_diff'])
+                        'phase_diff': (['reg_reg', 'time'], phase_diffs)
                         }
 
-            coords = {'time': (['time'], act_dict['time'], {'units': 'm/s',
-                                                            'sampling_rate': act_dict['s_rate']}),
-                      'task_type': ('time', act_dict['task_type']),
-                      'trial_number': ('time', act_dict['trial_number']),
-                      'trial_time_point': ('time', act_dict['trial_time'])
+            coords = {'time': (['time'], act_time, {'units': 'm/s',
+                                                    'sampling_rate': s_rate}),
+                      'task_type': ('time', task_type),
+                      'task_code': ('time', task_code),
+                      # name of each task code, task_names[task_code] gives task_type
+                      'task_names': ('task', labels),
+                      'trial_number': ('time', trial_number),
+                      'trial_time_point': ('time', trial_time_point)
                       }
             attrs = {"model": "WC"}
-            ds = xr.Dataset(data_vars=act_vars,
-                            coords=coords, attrs=attrs)
-
-            return ds
-        else:
-            return act_dict
+            return xr.Dataset(data_vars=act_vars,
+                              coords=coords, attrs=attrs)
+        return {'activity': activity, 'phase_diff': phase_diffs,
+                'time': act_time, 's_rate': s_rate, 'task_type': task_type,
+                'task_code': task_code, 'task_names': labels,
+                'trial_time': trial_time_point, 'trial_number': trial_number}
 
     def generate_bold(self,
                       bold_input,
@@ -882,12 +1272,71 @@ class WCTaskSim:
         return (hrf.t_BOLD[drop_idxs:], hrf.BOLD[:, drop_idxs:])
 
 
-def normalize(signal):
+def _run_single_simulation(cls, mat_path, seed, generate_kwargs, kwargs):
+    """ Worker for WCTaskSim.run_many, runs in a separate process """
+    if seed is not None:
+        np.random.seed(seed)
+    sim = cls.from_matlab_structure(mat_path, seed=seed, **kwargs)
+    sim.generate_full_series(**generate_kwargs)
+    return sim.BOLD, sim.activity
+
+
+def _tile_rows(x: npt.NDArray, k: int) -> npt.NDArray:
+    """ Read-only view of x with each row repeated k times, shape (M, k, T),
+    reshape to (M * k, T) gives the same array as np.repeat(x, k, axis=0) """
+    return np.broadcast_to(x[:, None, :], (x.shape[0], k, x.shape[1]))
+
+
+@lru_cache(maxsize=64)
+def _get_sos(order: int, low: float, high: Optional[float], s_rate: float, btype: str):
+    """ Butterworth filter in second-order sections, cached by its parameters
+
+    Args:
+        order (int): filter order
+        low (float): low cutoff frequency (Hz), the only one for lowpass
+        high (float): high cutoff frequency (Hz) for bandpass, None for lowpass
+        s_rate (float): sampling interval of the signal, in seconds
+        btype (str): 'bandpass' or 'lowpass'
+
+    Returns:
+        read-only sos array, shared between calls
+    """
+    nyquist = 1 / s_rate / 2
+    if btype == 'bandpass':
+        wn = [low / nyquist, high / nyquist]
+    else:
+        wn = low / nyquist
+    sos = signal.butter(order, wn, btype=btype, output='sos')
+    sos.setflags(write=False)
+    return sos
+
+
+@lru_cache(maxsize=8)
+def _triu_pairs(n: int):
+    """ Region pairs above the diagonal, np.triu_indices(n, k=1) cached by n
+
+    Returns:
+        tuple of read-only index arrays, shared between calls
+    """
+    idx1, idx2 = np.triu_indices(n, k=1)
+    idx1.setflags(write=False)
+    idx2.setflags(write=False)
+    return idx1, idx2
+
+
+def normalize(signal, out: Optional[npt.NDArray] = None):
+    """ Z-score each row of signal, result is written to out if it is given
+    (may be signal itself), otherwise to a new array """
     if signal.ndim == 1:
         signal = signal.reshape(1, -1)
-    mean_ = np.mean(signal, axis=1).reshape(-1, 1)
-    std_ = np.std(signal, axis=1).reshape(-1, 1)
-    return (signal - mean_) / std_
+    mean_ = np.mean(signal, axis=1, keepdims=True)
+    std_ = np.std(signal, axis=1, keepdims=True)
+    if out is None:
+        out = np.empty(signal.shape, dtype=np.result_type(signal, std_))
+    out = out.reshape(signal.shape)
+    np.subtract(signal, mean_, out=out)
+    np.divide(out, std_, out=out)
+    return out
 
 
 class HRF:
@@ -919,6 +1368,8 @@ class HRF:
         self.BOLD_chunk = np.array([], dtype="f", ndmin=2)
 
         self.idxLastT = 0  # Index of the last computed t
+        # gamma hrf kernels by their parameters, dt is fixed for the instance
+        self._gamma_kernel_cache = {}
 
         # initialize BOLD model variables
         # self.X_BOLD = np.ones((N,))
@@ -951,15 +1402,12 @@ class HRF:
         max_onset = np.max([np.max(onset) for onset in onsets])
         length = int((max_onset + duration + last_rest) * 1000 / self.dt)
         length_first_rest = int(first_rest * 1000 / self.dt)
-        activation = np.zeros((self.N, length))
         assert isinstance(onsets, list), "Onsets should be a list or list of lists"
+        assert len(onsets) >= self.N, "Onsets should be given for each of N regions"
 
-        for i in range(self.N):
-            for onset in onsets[i]:
-                start = int(round((1000 / self.dt) * onset))
-                end = int(round((1000 / self.dt) * (onset + duration)))
-                activation[i, start:end] = 1
-        return np.hstack((np.zeros((self.N, length_first_rest)), activation))
+        onsets = _pad_to_2d(onsets[:self.N], fill=-1)
+        return _boxcar_vectorized(onsets, np.full_like(onsets, duration), self.dt,
+                                  length, offset=length_first_rest)
 
     def resample_to_TR(self,
                        signal,
@@ -971,15 +1419,12 @@ class HRF:
         Returns:
             resampled to TR signal
         """
-        signal_resampled = signal[:,
-                           self.samplingRate_NDt - np.mod(idxLastT - 1,
-                                                          self.samplingRate_NDt):: self.samplingRate_NDt]
-        t_new_idx = idxLastT + np.arange(signal.shape[1])
-        t_resampled = (
-                t_new_idx[self.samplingRate_NDt - np.mod(idxLastT - 1,
-                                                         self.samplingRate_NDt):: self.samplingRate_NDt]
-                * self.dt
-        )
+        # first point at global index 1 mod samplingRate_NDt, as for the whole series
+        start = (1 - idxLastT) % self.samplingRate_NDt
+        signal_resampled = signal[:, start::self.samplingRate_NDt]
+        # time of the resampled points directly, without index of each point
+        t_resampled = (idxLastT + start
+                       + np.arange(signal_resampled.shape[1]) * self.samplingRate_NDt) * self.dt
         return t_resampled, signal_resampled
 
     def bw_convolve(self,
@@ -987,10 +1432,10 @@ class HRF:
                     append=False,
                     **kwargs):
         assert activity.shape[0] == self.N, "Input shape must be equal to Number of activations to times"
-        if self.normalize_input:
-            activity = self.normalize_max * activity
+        # scaling is applied inside the integration, without scaled copy of activity
+        scale = self.normalize_max if self.normalize_input else 1.0
 
-            # Compute the BOLD signal for the chunk
+        # Compute the BOLD signal for the chunk
         BOLD_chunk, self.X_BOLD, self.F_BOLD, self.Q_BOLD, self.V_BOLD = simulateBOLD(activity,
                                                                                       self.dt * 1e-3,
                                                                                       X=self.X_BOLD,
@@ -998,6 +1443,7 @@ class HRF:
                                                                                       Q=self.Q_BOLD,
                                                                                       V=self.V_BOLD,
                                                                                       fix=self.fix,
+                                                                                      scale=scale,
                                                                                       **kwargs)
 
         t_BOLD_resampled, BOLD_resampled = self.resample_to_TR(BOLD_chunk, idxLastT=self.idxLastT)
@@ -1021,24 +1467,19 @@ class HRF:
 
     def gamma_convolve(self, activity, append=False, **kwargs):
         assert activity.shape[0] == self.N, "Input shape must be equal to Number of activations to times"
+        key = tuple(sorted(kwargs.items()))
+        hrf_at_dt = self._gamma_kernel_cache.get(key)
+        if hrf_at_dt is None:
+            hrf_at_dt = self._gamma_hrf(**kwargs)
+            self._gamma_kernel_cache[key] = hrf_at_dt
+        # convolution is linear, so the short kernel is scaled instead of activity
         if self.normalize_input:
-            activity = self.normalize_max * activity
-        hrf_at_dt = self._gamma_hrf(**kwargs)
-        BOLD_chunk = np.zeros_like(activity)
-        for i in range(self.N):
-            BOLD_chunk[i, :] = np.convolve(activity[i], hrf_at_dt)[:-(len(hrf_at_dt) - 1)]
-
-        BOLD_resampled = BOLD_chunk[
-                         :, self.samplingRate_NDt - np.mod(self.idxLastT - 1,
-                                                           self.samplingRate_NDt):: self.samplingRate_NDt
-                         ]
-        t_new_idx = self.idxLastT + np.arange(activity.shape[1])
-        t_BOLD_resampled = (
-                t_new_idx[
-                self.samplingRate_NDt - np.mod(self.idxLastT - 1,
-                                               self.samplingRate_NDt):: self.samplingRate_NDt]
-                * self.dt
-        )
+            hrf_at_dt = self.normalize_max * hrf_at_dt
+        # overlap-add convolution of all regions at once, causal part only
+        BOLD_chunk = signal.oaconvolve(activity, hrf_at_dt[None, :],
+                                       mode='full', axes=-1)[:, :activity.shape[1]]
+
+        t_BOLD_resampled, BOLD_resampled = self.resample_to_TR(BOLD_chunk, idxLastT=self.idxLastT)
 
         if self.BOLD.shape[1] == 0:
             # add new data
@@ -1071,11 +1512,10 @@ class HRF:
         """
 
         # Gamma pdf for the peak
-        from scipy.stats import gamma
         times = np.arange(0, length, self.dt * 1e-3)
-        peak_values = gamma.pdf(times, peak)
+        peak_values = stats.gamma.pdf(times, peak)
         # Gamma pdf for the undershoot
-        undershoot_values = gamma.pdf(times, undershoot)
+        undershoot_values = stats.gamma.pdf(times, undershoot)
         # Combine them
         values = peak_values - beta * undershoot_values
         # Scale max to 0.6